@@ -1,14 +1,15 @@
 import time
-from dataclasses import InitVar, dataclass
-from functools import cached_property
+from collections.abc import Callable
+from dataclasses import InitVar, dataclass, field
 from typing import Final, TypeAlias
 
 FractionalSeconds: TypeAlias = float
 NanoSeconds: TypeAlias = int
 _SECOND_AS_NS: Final[NanoSeconds] = 1_000_000_000
+Clock: TypeAlias = Callable[[], NanoSeconds]
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Rate:
     """
     How often something happens with period expressed in nanoseconds
@@ -26,14 +27,29 @@ class Rate:
     >>> one_per_half_second = Rate(1, half_second_as_ns)
     >>> assert one_per_half_second.period_ns == half_second_as_ns
     >>> assert one_per_half_second == two_per_second
+
+    >>> Rate(2, 1e9).period_ns
+    500000000
+    >>> Rate(2.5).period_ns
+    400000000
+
+    ``period_sec`` is the same period as a fractional second
+
+    >>> import math
+    >>> assert math.isclose(Rate().period_sec, 1.0)
+    >>> assert math.isclose(Rate(2).period_sec, 0.5)
+    >>> assert math.isclose(Rate(3, 60 * _SECOND_AS_NS).period_sec, 20.0)
     """
     amount: InitVar[int] = 1
     period_ns: NanoSeconds = _SECOND_AS_NS
+    # Derived from `period_ns`, so excluded from `__init__`, `__repr__` and `__eq__`
+    period_sec: FractionalSeconds = field(init=False, repr=False, compare=False)
 
     def __post_init__(self, amount: int) -> None:
         if amount < 1:
             raise ValueError(f"`amount` should be integer >= 1, got {amount}")
-        object.__setattr__(self, "period_ns", int(self.period_ns / amount))
+        object.__setattr__(self, "period_ns", int(self.period_ns // amount))
+        object.__setattr__(self, "period_sec", self.period_ns / _SECOND_AS_NS)
 
     @classmethod
     def from_frequency(cls, frequency_per_sec: float) -> 'Rate':
@@ -53,32 +69,18 @@ class Rate:
         >>> from_freq = Rate.from_frequency(0.5)  # 0.5 rps
         >>> assert rate == from_freq
 
+        Period is rounded to the nearest nanosecond, not truncated.
+        >>> Rate.from_frequency(3).period_ns
+        333333333
+        >>> Rate.from_frequency(7).period_ns
+        142857143
+
         :param frequency_per_sec: How often something happens per second
         :return: Rate
         """
-        period_sec = 1 / frequency_per_sec
-        period_ns = int(period_sec * _SECOND_AS_NS)
+        period_ns = round(_SECOND_AS_NS / frequency_per_sec)
         return cls(1, period_ns)
 
-    @cached_property
-    def period_sec(self) -> FractionalSeconds:
-        """
-        Refill preiod as a fractional second
-
-        >>> import math
-        >>> rr = Rate()
-        >>> assert math.isclose(rr.period_sec, 1.0)
-
-        >>> rr = Rate(2)
-        >>> assert math.isclose(rr.period_sec, 0.5)
-
-        >>> rr = Rate(3, 60 * _SECOND_AS_NS)
-        >>> assert math.isclose(rr.period_sec, 20.0)
-
-        :return: period in fractional seconds
-        """
-        return self.period_ns / _SECOND_AS_NS
-
 
 _ONE_PER_SECOND: Final[Rate] = Rate()
 
@@ -89,20 +91,36 @@ class Bucket:
 
     Uses ``time.monotonic_ns`` to be resilient to system clock changes.
     For example correction via NTP. See `PEP 418`_ for more.
+    Other monotonic nanosecond clock can be passed as ``clock``.
 
     .. _token bucket: https://en.wikipedia.org/wiki/Token_bucket
     .. _PEP 418: https://peps.python.org/pep-0418/
     """
+    __slots__ = (
+        "_volume", "_current", "_refill_rate", "_last_refill_ns", "_period_ns",
+        "_clock",
+    )
+
     _volume: Final[int]
     _refill_rate: Final[Rate]
     _current: int
     _last_refill_ns: NanoSeconds
-
-    def __init__(self, volume: int = 1, refill_rate: Rate = _ONE_PER_SECOND) -> None:
+    _period_ns: Final[NanoSeconds]
+    _clock: Final[Clock]
+
+    def __init__(
+            self,
+            volume: int = 1,
+            refill_rate: Rate = _ONE_PER_SECOND,
+            clock: Clock = time.monotonic_ns,
+    ) -> None:
         self._volume = volume
         self._current = volume
         self._refill_rate = refill_rate
-        self._last_refill_ns = time.monotonic_ns()
+        # `Rate` is immutable, keep period at hand for the hot path
+        self._period_ns = refill_rate.period_ns
+        self._clock = clock
+        self._last_refill_ns = clock()
 
     @property
     def is_empty(self) -> bool:
@@ -156,10 +174,47 @@ class Bucket:
 
         self._current -= amount
 
-    def refill(self) -> None:
+    def remove_up_to(self, amount: int, /) -> int:
+        """
+        Remove at most ``amount`` of tokens, but no more than available.
+
+        Unlike ``remove`` never takes the bucket into negatives.
+
+        >>> b = Bucket(5)
+        >>> b.remove_up_to(-1)
+        Traceback (most recent call last):
+            ...
+        ValueError: Can remove only positive amount, got -1!
+        >>> b.remove_up_to(3)
+        3
+        >>> b.remove_up_to(3)  # only 2 left
+        2
+        >>> b.remove_up_to(3)
+        0
+        >>> b._current
+        0
+        >>> b.remove(2)  # already negative bucket yields nothing
+        >>> b.remove_up_to(1), b._current
+        (0, -2)
+        >>>
+
+        :param amount: How many tokens to remove at most
+        :return: How many tokens were actually removed
+        """
+        if amount < 0:
+            raise ValueError(f"Can remove only positive amount, got {amount}!")
+
+        removed = min(amount, max(self._current, 0))
+        self._current -= removed
+        return removed
+
+    def refill(self, now: NanoSeconds | None = None, /) -> None:
         """
         Refill the bucket according to its refill rate.
 
+        ``now`` allows callers to reuse an already taken
+        reading of bucket's clock instead of sampling it again.
+
         >>> volume, refill_rate = 1, Rate(1, 2 * _SECOND_AS_NS)
         >>> b = Bucket(volume, refill_rate=refill_rate)
 
@@ -170,6 +225,9 @@ class Bucket:
         ...     assert b._current == volume
         ...     assert b._last_refill_ns != last_update
         ...     last_update = b._last_refill_ns
+        >>> b.refill(last_update + 10 * refill_rate.period_ns)
+        >>> b._current, b._last_refill_ns - last_update == 10 * refill_rate.period_ns
+        (1, True)
 
         Tries to not lose any tokens.
         >>> import math
@@ -197,19 +255,40 @@ class Bucket:
         (False, 2)
         >>> (b._last_refill_ns - last_update) >= 2 * refill_rate.period_ns
         True
+
+        Leftover of a period is kept even when bucket becomes full.
+        >>> b = Bucket(1, Rate(1, 1000), clock=lambda: 0)
+        >>> b.remove()
+        >>> b.refill(1500)
+        >>> b._current, b._last_refill_ns
+        (1, 1000)
+
+        Stale ``now`` is ignored.
+        >>> b = Bucket(2, Rate(1, 1000), clock=lambda: 10_000)
+        >>> b.remove()
+        >>> b.refill(9_999)
+        >>> b._current, b._last_refill_ns
+        (1, 10000)
         >>>
 
+        :param now: Current value of bucket's clock, sampled if omitted
         :return: None
         """
-        refill_needed = self._current < self._volume
-        if not refill_needed:
-            self._last_refill_ns = time.monotonic_ns()
+        if now is None:
+            now = self._clock()
+        if now <= self._last_refill_ns:
+            # Stale timestamp, no time has passed since the last refill.
+            return
+        if self._current >= self._volume:
+            # Common case for high rate limits, skip token arithmetic entirely.
+            self._last_refill_ns = now
             return
-        time_since_last_refill = time.monotonic_ns() - self._last_refill_ns
-        n_tokens = int(time_since_last_refill / self._refill_rate.period_ns)
-        self._current = min(self._current + n_tokens, self._volume)
+        time_since_last_refill = now - self._last_refill_ns
+        n_tokens, remainder = divmod(time_since_last_refill, self._period_ns)
+        current = self._current + n_tokens
+        self._current = current if current < self._volume else self._volume
         # Offset to not lose tokens. Might be significant with slow refill rates.
-        self._last_refill_ns += n_tokens * self._refill_rate.period_ns
+        self._last_refill_ns = now - remainder
 
     def __repr__(self) -> str:
         return (
@@ -247,7 +326,20 @@ class RateLimiter:
     ...     time.sleep(rps.period_sec)
     >>> acceptance
     [True, False, True, False, True]
+
+    Steady requests slightly faster than the rate don't lose the refill
+    progress made between them.
+    >>> now = 0
+    >>> rl = RateLimiter(1)
+    >>> rl._bucket = Bucket(1, Rate(), clock=lambda: now)
+    >>> granted = 0
+    >>> for now in range(0, 100 * 900_000_000, 900_000_000):  # every 0.9 sec
+    ...     granted += rl.allow()
+    >>> granted
+    90
     """
+    __slots__ = ("_bucket",)
+
     _bucket: Final[Bucket]
 
     def __init__(self, rps: float = 1.0) -> None:
@@ -258,13 +350,64 @@ class RateLimiter:
         This method should be called every time client code receives a request.
         Updates internal timer on each call.
 
+        Behaves exactly as ``Bucket.refill`` followed by ``Bucket.remove``.
+        >>> now = 0
+        >>> rl = RateLimiter(1)
+        >>> rl._bucket = inlined = Bucket(3, Rate(1, 100), clock=lambda: now)
+        >>> b = Bucket(3, Rate(1, 100), clock=lambda: now)
+        >>> # includes bursts, stale timestamps and long pauses
+        >>> for now in [0, 0, 10, 150, 149, 160, 170, 180, 400, 390, 401, 1000, 1050]:
+        ...     allowed = rl.allow()
+        ...     b.refill()
+        ...     assert allowed is not b.is_empty
+        ...     if allowed:
+        ...         b.remove()
+        ...     assert (inlined._current, inlined._last_refill_ns) == (
+        ...         b._current, b._last_refill_ns
+        ...     ), now
+        >>>
+
         :return: True if rate limit is not exceeded, False otherwise
         """
-        self._bucket.refill()
-
-        if self._bucket.is_empty:
+        # Inlined `Bucket.refill`, `Bucket.is_empty` and `Bucket.remove` to save
+        # on method calls. Keep in sync with them.
+        bucket = self._bucket
+        now = bucket._clock()
+        current = bucket._current
+        if now <= bucket._last_refill_ns:
+            # Stale timestamp, no time has passed since the last refill.
+            pass
+        elif current >= bucket._volume:
+            bucket._last_refill_ns = now
+        else:
+            n_tokens, remainder = divmod(now - bucket._last_refill_ns, bucket._period_ns)
+            current += n_tokens
+            if current > bucket._volume:
+                current = bucket._volume
+            bucket._last_refill_ns = now - remainder
+
+        if current <= 0:
+            bucket._current = current
             return False
 
-        self._bucket.remove()
+        bucket._current = current - 1
 
         return True
+
+    def allow_many(self, n: int, /) -> int:
+        """
+        Batch version of ``allow`` for ``n`` requests received at once.
+        Reads the clock only once for the whole batch.
+
+        >>> rl = RateLimiter(1)
+        >>> rl.allow_many(3)
+        1
+        >>> rl.allow_many(3)
+        0
+
+        :param n: Number of requests
+        :return: How many of ``n`` requests don't exceed the rate limit
+        """
+        self._bucket.refill()
+
+        return self._bucket.remove_up_to(n)